@@ -65,20 +65,19 @@ def needs_quoting(string: str, allow_reserved: bool) -> bool:
         # require quoting
         return False
 
-    isalnum = _re_ident.fullmatch(string)
+    if not _re_ident.fullmatch(string):
+        return True
+
+    if allow_reserved:
+        return False
 
     string = string.lower()
 
-    is_reserved = (
+    return (
         string not in {'__type__', '__std__'}
         and string in keywords.by_type[keywords.RESERVED_KEYWORD]
     )
 
-    return (
-        not isalnum
-        or (not allow_reserved and is_reserved)
-    )
-
 
 def _quote_ident(string: str) -> str:
     return '`' + string.replace('`', '``') + '`'
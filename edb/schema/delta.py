@@ -20,12 +20,15 @@
 from __future__ import annotations
 from typing import *
 
-import collections
 import collections.abc
 import contextlib
+import functools
 import itertools
+import operator
+import types
 import uuid
 
+from edb import edgeql
 from edb import errors
 
 from edb.common import adapter
@@ -60,39 +63,53 @@ def delta_objects(
 ) -> DeltaRoot:
 
     delta = DeltaRoot()
+    is_inh = issubclass(sclass, so.InheritingObject)
 
-    oldkeys = {o.id: o.hash_criteria(old_schema) for o in old}
-    newkeys = {o.id: o.hash_criteria(new_schema) for o in new}
+    # The inputs may be lazy schema iterators, so make sure they are
+    # only traversed once.
+    oldkeys = {o: o.hash_criteria(old_schema) for o in old}
+    newkeys = {o: o.hash_criteria(new_schema) for o in new}
 
     unchanged = set(oldkeys.values()) & set(newkeys.values())
 
     old = ordered.OrderedSet[so.Object_T](
-        o for o in old
-        if oldkeys[o.id] not in unchanged
+        o for o, key in oldkeys.items()
+        if key not in unchanged
     )
     new = ordered.OrderedSet[so.Object_T](
-        o for o in new
-        if newkeys[o.id] not in unchanged
+        o for o, key in newkeys.items()
+        if key not in unchanged
     )
 
-    oldnames = {o.get_name(old_schema) for o in old}
-    newnames = {o.get_name(new_schema) for o in new}
-    common_names = oldnames & newnames
+    old_names = {o: o.get_name(old_schema) for o in old}
+    new_names = {o: o.get_name(new_schema) for o in new}
+    common_names = set(old_names.values()) & set(new_names.values())
 
-    pairs = sorted(
-        itertools.product(new, old),
-        key=lambda pair: pair[0].get_name(new_schema) not in common_names,
+    # Pairs of objects with a name in common are compared first.
+    common_new = [x for x in new if new_names[x] in common_names]
+    other_new = [x for x in new if new_names[x] not in common_names]
+    pairs = itertools.chain(
+        itertools.product(common_new, old),
+        itertools.product(other_new, old),
+    )
+
+    banned_alters = (
+        context.guidance.banned_alters
+        if context.guidance is not None else None
     )
 
     full_matrix: List[Tuple[so.Object_T, so.Object_T, float]] = []
+    # The matrix is ordered by descending similarity and then by names.
+    # Sort keys are accumulated alongside the matrix and use name ranks,
+    # so that the sort only needs to compare tuples of numbers.
+    sort_keys: List[Tuple[float, int, int]] = []
+    new_ranks = _rank_by_name(new_names)
+    old_ranks = _rank_by_name(old_names)
 
     for x, y in pairs:
-        x_name = x.get_name(new_schema)
-        y_name = y.get_name(old_schema)
-
         if (
-            context.guidance is not None
-            and (sclass, (y_name, x_name)) in context.guidance.banned_alters
+            banned_alters is not None
+            and (sclass, (old_names[y], new_names[x])) in banned_alters
         ):
             similarity = 0.0
         else:
@@ -104,28 +121,31 @@ def delta_objects(
             )
 
         full_matrix.append((x, y, similarity))
+        sort_keys.append((1.0 - similarity, new_ranks[x], old_ranks[y]))
 
-    full_matrix.sort(
-        key=lambda v: (
-            1.0 - v[2],
-            v[0].get_name(new_schema),
-            v[1].get_name(old_schema),
-        ),
-    )
+    order = sorted(range(len(full_matrix)), key=sort_keys.__getitem__)
 
-    seen_x = set()
-    seen_y = set()
+    # Greedily pick the best remaining match for every object.  Once
+    # either side is exhausted no further pair can be picked, so stop
+    # walking the matrix early.  Matched objects are tracked by identity,
+    # which avoids hashing an (id, type) tuple in Object.__hash__.
+    max_matches = min(len(new), len(old))
+    seen_x: Set[int] = set()
+    seen_y: Set[int] = set()
     comparison_map: Dict[so.Object_T, Tuple[float, so.Object_T]] = {}
-    for x, y, similarity in full_matrix:
-        if x not in seen_x and y not in seen_y:
+    for i in order:
+        if len(comparison_map) == max_matches:
+            break
+        x, y, similarity = full_matrix[i]
+        if id(x) not in seen_x and id(y) not in seen_y:
             comparison_map[x] = (similarity, y)
-            seen_x.add(x)
-            seen_y.add(y)
+            seen_x.add(id(x))
+            seen_y.add(id(y))
 
     alters = []
 
     if comparison_map:
-        if issubclass(sclass, so.InheritingObject):
+        if is_inh:
             # Generate the diff from the top of the inheritance
             # hierarchy, since changes to parent objects may inform
             # how the delta in child objects is treated.
@@ -133,7 +153,7 @@ def delta_objects(
                 Iterable[so.Object_T],
                 _sort_by_inheritance(
                     new_schema,
-                    cast(Iterable[so.InheritingObject], comparison_map),
+                    cast(Collection[so.InheritingObject], comparison_map),
                 ),
             )
         else:
@@ -151,13 +171,20 @@ def delta_objects(
 
                 alters.append(alter)
 
-    created = new - {x for x, (s, _) in comparison_map.items() if s > 0.6}
+    matched_x: Set[so.Object_T] = set()
+    matched_y: Set[so.Object_T] = set()
+    for x, (s, y) in comparison_map.items():
+        if s > 0.6:
+            matched_x.add(x)
+            matched_y.add(y)
+
+    created = new - matched_x
 
     for x in created:
         if (
             context.guidance is None
             or (
-                (sclass, x.get_name(new_schema))
+                (sclass, new_names[x])
                 not in context.guidance.banned_creations
             )
         ):
@@ -171,12 +198,12 @@ def delta_objects(
     delta.update(alters)
 
     deleted_order: Iterable[so.Object]
-    deleted = old - {y for _, (s, y) in comparison_map.items() if s > 0.6}
+    deleted = old - matched_y
 
-    if issubclass(sclass, so.InheritingObject):
+    if is_inh:
         deleted_order = _sort_by_inheritance(
             old_schema,
-            cast(Iterable[so.InheritingObject], deleted),
+            cast(Collection[so.InheritingObject], deleted),
         )
     else:
         deleted_order = deleted
@@ -185,7 +212,7 @@ def delta_objects(
         if (
             context.guidance is None
             or (
-                (sclass, obj.get_name(old_schema))
+                (sclass, old_names[obj])
                 not in context.guidance.banned_deletions
             )
         ):
@@ -199,15 +226,33 @@ def delta_objects(
     return delta
 
 
+def _rank_by_name(
+    names: Mapping[so.Object_T, str],
+) -> Dict[so.Object_T, int]:
+    ranks = {name: i for i, name in enumerate(sorted(set(names.values())))}
+    return {o: ranks[name] for o, name in names.items()}
+
+
 def _sort_by_inheritance(
     schema: s_schema.Schema,
-    objs: Iterable[so.InheritingObjectT],
+    objs: Collection[so.InheritingObjectT],
 ) -> Iterable[so.InheritingObjectT]:
+    if len(objs) <= 1:
+        return objs
+
+    # Only bases that are being sorted matter, so map base ids onto
+    # the input objects directly rather than resolving every base in
+    # the schema.  The deps are kept as a tuple to preserve base order.
+    by_id = {x.id: x for x in objs}
     graph = {}
     for x in objs:
         graph[x] = {
             'item': x,
-            'deps': x.get_bases(schema).objects(schema),
+            'deps': tuple(
+                by_id[base_id]
+                for base_id in x.get_bases(schema).ids(schema)
+                if base_id in by_id
+            ),
         }
 
     return cast(
@@ -264,20 +309,26 @@ class CommandMeta(
         cls,
         astnodes: Iterable[Type[qlast.DDLCommand]],
     ) -> None:
-        mapping = type(cls)._astnode_map
+        mapping = CommandMeta._astnode_map
+        cmdcls = cast(Type["Command"], cls)
 
         for astnode in astnodes:
-            existing = mapping.get(astnode)
-            if existing:
+            existing = mapping.setdefault(astnode, cmdcls)
+            if existing is not cmdcls:
                 msg = ('duplicate EdgeQL AST node to command mapping: ' +
                        '{!r} is already declared for {!r}')
                 raise TypeError(msg.format(astnode, existing))
 
-            mapping[astnode] = cast(Type["Command"], cls)
-
 
 _void = object()
 
+# The source of attribute values set by inheritance.
+_INHERITANCE = 'inheritance'
+
+_get_property = operator.attrgetter('property')
+
+_SOURCE_ANCHOR = qlast.Source().name
+
 
 # We use _DummyObject for contexts where an instance of an object is
 # required by type signatures, and the actual reference will be quickly
@@ -294,25 +345,34 @@ class Command(struct.MixedStruct, metaclass=CommandMeta):
 
     _context_class: Optional[Type[CommandContextToken[Command]]] = None
 
-    ops: ordered.OrderedSet[Command]
-    before_ops: ordered.OrderedSet[Command]
+    #: Subcommands and prerequisites.  These are dicts used as
+    #: insertion-ordered sets (all values are None).
+    ops: Dict[Command, None]
+    before_ops: Dict[Command, None]
 
     #: AlterObjectProperty lookup table for get|set_attribute_value
     _attrs: Dict[str, AlterObjectProperty]
 
+    #: Results of get_subcommands() without a metaclass filter, keyed
+    #: by (type, include_prerequisites) and reset on every change
+    #: to ops or before_ops.
+    _subcommands_by_type: Dict[
+        Tuple[Optional[type], bool],
+        Tuple[Command, ...],
+    ]
+
     def __init__(self, **kwargs: Any) -> None:
         super().__init__(**kwargs)
-        self.ops = ordered.OrderedSet()
-        self.before_ops = ordered.OrderedSet()
+        self.ops = {}
+        self.before_ops = {}
         self.qlast: qlast.DDLOperation
         self._attrs = {}
+        self._subcommands_by_type = {}
 
     def copy(self: Command_T) -> Command_T:
         result = super().copy()
-        result.ops = ordered.OrderedSet(
-            op.copy() for op in self.ops)
-        result.before_ops = ordered.OrderedSet(
-            op.copy() for op in self.before_ops)
+        result.ops = {op.copy(): None for op in self.ops}
+        result.before_ops = {op.copy(): None for op in self.before_ops}
         return result
 
     @classmethod
@@ -390,7 +450,7 @@ class Command(struct.MixedStruct, metaclass=CommandMeta):
         self,
         attr_name: str,
     ) -> Any:
-        op = self.get_attribute_set_cmd(attr_name)
+        op = self._attrs.get(attr_name)
         if op is not None:
             return op.new_value
         else:
@@ -401,8 +461,8 @@ class Command(struct.MixedStruct, metaclass=CommandMeta):
         attr_name: str,
     ) -> Any:
         """Return the new value of field, if not inherited."""
-        op = self.get_attribute_set_cmd(attr_name)
-        if op is not None and op.source != 'inheritance':
+        op = self._attrs.get(attr_name)
+        if op is not None and op.source != _INHERITANCE:
             return op.new_value
         else:
             return None
@@ -411,7 +471,7 @@ class Command(struct.MixedStruct, metaclass=CommandMeta):
         self,
         attr_name: str,
     ) -> Any:
-        op = self.get_attribute_set_cmd(attr_name)
+        op = self._attrs.get(attr_name)
         if op is not None:
             return op.old_value
         else:
@@ -421,7 +481,7 @@ class Command(struct.MixedStruct, metaclass=CommandMeta):
         self,
         attr_name: str,
     ) -> Optional[parsing.ParserContext]:
-        op = self.get_attribute_set_cmd(attr_name)
+        op = self._attrs.get(attr_name)
         if op is not None:
             return op.source_context
         else:
@@ -436,14 +496,14 @@ class Command(struct.MixedStruct, metaclass=CommandMeta):
         inherited: bool = False,
         source_context: Optional[parsing.ParserContext] = None,
     ) -> None:
-        orig_op = op = self.get_attribute_set_cmd(attr_name)
+        orig_op = op = self._attrs.get(attr_name)
         if op is None:
             op = AlterObjectProperty(property=attr_name, new_value=value)
         else:
             op.new_value = value
 
         if inherited:
-            op.source = 'inheritance'
+            op.source = _INHERITANCE
         if source_context is not None:
             op.source_context = source_context
         if orig_value is not None:
@@ -453,7 +513,7 @@ class Command(struct.MixedStruct, metaclass=CommandMeta):
             self.add(op)
 
     def discard_attribute(self, attr_name: str) -> None:
-        op = self.get_attribute_set_cmd(attr_name)
+        op = self._attrs.get(attr_name)
         if op is not None:
             self.discard(op)
 
@@ -488,30 +548,31 @@ class Command(struct.MixedStruct, metaclass=CommandMeta):
         include_prerequisites: bool = True,
     ) -> Tuple[Command, ...]:
         ops: Iterable[Command]
-        if include_prerequisites:
+        if include_prerequisites and self.before_ops:
             ops = itertools.chain(self.before_ops, self.ops)
         else:
             ops = self.ops
 
-        filters = []
+        if metaclass is None:
+            key = (type, include_prerequisites)
+            subcommands = self._subcommands_by_type.get(key)
+            if subcommands is None:
+                if type is None:
+                    subcommands = tuple(ops)
+                else:
+                    subcommands = tuple(
+                        i for i in ops if isinstance(i, type))
+                self._subcommands_by_type[key] = subcommands
+            return subcommands
 
-        if type is not None:
-            t = type
-            filters.append(lambda i: isinstance(i, t))
-
-        if metaclass is not None:
-            mcls = metaclass
-            filters.append(
-                lambda i: (
-                    isinstance(i, ObjectCommand)
-                    and issubclass(i.get_schema_metaclass(), mcls)
-                )
+        return tuple(
+            i for i in ops
+            if (
+                (type is None or isinstance(i, type))
+                and isinstance(i, ObjectCommand)
+                and issubclass(i.get_schema_metaclass(), metaclass)
             )
-
-        if filters:
-            return tuple(filter(lambda i: all(f(i) for f in filters), ops))
-        else:
-            return tuple(ops)
+        )
 
     @overload
     def get_prerequisites(
@@ -555,51 +616,82 @@ class Command(struct.MixedStruct, metaclass=CommandMeta):
                 count += 1
         return count
 
+    def _iter_subcommands(
+        self,
+        *,
+        reverse: bool = False,
+    ) -> Iterator[Command]:
+        # Same order as get_subcommands(), but without building a tuple.
+        if reverse:
+            return itertools.chain(
+                reversed(self.ops), reversed(self.before_ops))
+        else:
+            return itertools.chain(self.before_ops, self.ops)
+
     def prepend_prerequisite(self, command: Command) -> None:
         if isinstance(command, CommandGroup):
-            for op in reversed(command.get_subcommands()):
-                self.prepend_prerequisite(op)
+            before_ops = dict.fromkeys(command._iter_subcommands())
         else:
-            self.before_ops.add(command, last=False)
+            before_ops = {command: None}
+        before_ops.update(self.before_ops)
+        self.before_ops = before_ops
+        self._subcommands_by_type.clear()
 
     def add_prerequisite(self, command: Command) -> None:
         if isinstance(command, CommandGroup):
-            self.before_ops.update(command.get_subcommands())  # type: ignore
+            self.before_ops.update(
+                dict.fromkeys(command._iter_subcommands()))
         else:
-            self.before_ops.add(command)
+            self.before_ops[command] = None
+        self._subcommands_by_type.clear()
 
     def prepend(self, command: Command) -> None:
         if isinstance(command, CommandGroup):
-            for op in reversed(command.get_subcommands()):
-                self.prepend(op)
+            ops = dict.fromkeys(command._iter_subcommands())
         else:
-            if isinstance(command, AlterObjectProperty):
-                self._attrs[command.property] = command
-            self.ops.add(command, last=False)
+            ops = {command: None}
+        # Walk backwards so that, as with one-by-one prepending, the
+        # frontmost AlterObjectProperty for a given property wins.
+        for op in reversed(ops):
+            if isinstance(op, AlterObjectProperty):
+                self._attrs[op.property] = op
+        ops.update(self.ops)
+        self.ops = ops
+        self._subcommands_by_type.clear()
 
     def add(self, command: Command) -> None:
         if isinstance(command, CommandGroup):
-            self.update(command.get_subcommands())
+            self.update(command._iter_subcommands())
         else:
             if isinstance(command, AlterObjectProperty):
                 self._attrs[command.property] = command
-            self.ops.add(command)
+            self.ops[command] = None
+            self._subcommands_by_type.clear()
 
     def update(self, commands: Iterable[Command]) -> None:  # type: ignore
         for command in commands:
             self.add(command)
 
     def replace(self, existing: Command, new: Command) -> None:  # type: ignore
-        self.ops.replace(existing, new)
+        # Unlike OrderedSet.replace(), *new* takes over the key of
+        # *existing*, so a later discard(new) or replace(new, ...) finds it.
+        if existing not in self.ops:
+            raise LookupError(f'{existing!r} is not in set')
+        self.ops = {
+            (new if op is existing else op): None for op in self.ops
+        }
+        self._subcommands_by_type.clear()
 
     def replace_all(self, commands: Iterable[Command]) -> None:
         self.ops.clear()
         self._attrs.clear()
+        self._subcommands_by_type.clear()
         self.update(commands)
 
     def discard(self, command: Command) -> None:
-        self.ops.discard(command)
-        self.before_ops.discard(command)
+        self.ops.pop(command, None)
+        self.before_ops.pop(command, None)
+        self._subcommands_by_type.clear()
         if isinstance(command, AlterObjectProperty):
             self._attrs.pop(command.property)
 
@@ -726,7 +818,7 @@ class Command(struct.MixedStruct, metaclass=CommandMeta):
                 diff = markup.elements.doc.ValueDiff(
                     before=repr(dd.old_value), after=repr(dd.new_value))
 
-                if dd.source == 'inheritance':
+                if dd.source == _INHERITANCE:
                     diff.comment = 'inherited'
 
                 node.add_child(label=dd.property, node=diff)
@@ -773,7 +865,26 @@ class CommandGroup(Command):
         return schema
 
 
+# Shared by all context tokens that do not declare module aliases,
+# so that pushing a token does not allocate an empty dict.
+_NO_MODALIASES: Mapping[Optional[str], str] = types.MappingProxyType({})
+
+
 class CommandContextToken(Generic[Command_T]):
+
+    __slots__ = (
+        'original_schema',
+        'op',
+        'modaliases',
+        'localnames',
+        'inheritance_merge',
+        'inheritance_refdicts',
+        'mark_derived',
+        'preserve_path_id',
+        'enable_recursion',
+        'transient_derivation',
+    )
+
     original_schema: s_schema.Schema
     op: Command_T
     modaliases: Mapping[Optional[str], str]
@@ -797,7 +908,8 @@ class CommandContextToken(Generic[Command_T]):
     ) -> None:
         self.original_schema = schema
         self.op = op
-        self.modaliases = modaliases if modaliases is not None else {}
+        self.modaliases = (
+            modaliases if modaliases is not None else _NO_MODALIASES)
         self.localnames = localnames
         self.inheritance_merge = None
         self.inheritance_refdicts = None
@@ -808,6 +920,9 @@ class CommandContextToken(Generic[Command_T]):
 
 
 class CommandContextWrapper(Generic[Command_T]):
+
+    __slots__ = ('context', 'token')
+
     def __init__(
         self,
         context: CommandContext,
@@ -829,7 +944,49 @@ class CommandContextWrapper(Generic[Command_T]):
         self.context.pop()
 
 
+@functools.lru_cache(maxsize=None)
+def _get_context_class(
+    cls: Union[Type[Command], Type[CommandContextToken[Command]]],
+) -> Type[CommandContextToken[Command]]:
+    if issubclass(cls, Command):
+        ctxcls = cls.get_context_class()
+        assert ctxcls is not None
+        return ctxcls
+    else:
+        return cls
+
+
 class CommandContext:
+
+    __slots__ = (
+        'stack',
+        '_by_class',
+        '_cache',
+        '_attribute_cache',
+        '_object_cache',
+        '_object_cache_schema',
+        '_values',
+        'declarative',
+        'schema',
+        '_modaliases',
+        '_localnames',
+        '_modaliases_stack',
+        '_localnames_stack',
+        'stdmode',
+        'testmode',
+        'descriptive_mode',
+        'disable_dep_verification',
+        'renames',
+        'renamed_objs',
+        'altered_targets',
+        'canonicalized_renames',
+        'canonicalized_deletions',
+        'schema_object_ids',
+        'backend_superuser_role',
+        'affected_finalization',
+        'compat_ver',
+    )
+
     def __init__(
         self,
         *,
@@ -848,12 +1005,24 @@ class CommandContext:
         compat_ver: Optional[verutils.Version] = None,
     ) -> None:
         self.stack: List[CommandContextToken[Command]] = []
+        # Stack positions of the tokens of every context class,
+        # including base classes, maintained by push() and pop().
+        self._by_class: Dict[type, List[int]] = {}
         self._cache: Dict[Hashable, Any] = {}
+        self._attribute_cache: Dict[Command, Dict[str, Any]] = {}
+        self._object_cache: Dict[Tuple[type, str], so.Object] = {}
+        self._object_cache_schema: Optional[s_schema.Schema] = None
         self._values: Dict[Hashable, Any] = {}
         self.declarative = declarative
         self.schema = schema
         self._modaliases = modaliases if modaliases is not None else {}
         self._localnames = localnames
+        # Effective module aliases and local names at every level of
+        # the stack, maintained by push() and pop().
+        self._modaliases_stack: List[Mapping[Optional[str], str]] = [
+            self._modaliases]
+        self._localnames_stack: List[AbstractSet[str]] = [
+            frozenset(localnames)]
         self.stdmode = stdmode
         self.testmode = testmode
         self.descriptive_mode = descriptive_mode
@@ -861,6 +1030,10 @@ class CommandContext:
         self.renames: Dict[str, str] = {}
         self.renamed_objs: Set[so.Object] = set()
         self.altered_targets: Set[so.Object] = set()
+        # Rename and delete commands that have already been expanded
+        # by their _canonicalize() methods.
+        self.canonicalized_renames: Set[Command] = set()
+        self.canonicalized_deletions: Set[Command] = set()
         self.schema_object_ids = schema_object_ids
         self.backend_superuser_role = backend_superuser_role
         self.affected_finalization: \
@@ -869,17 +1042,11 @@ class CommandContext:
 
     @property
     def modaliases(self) -> Mapping[Optional[str], str]:
-        maps = [t.modaliases for t in reversed(self.stack)]
-        maps.append(self._modaliases)
-        return collections.ChainMap(*maps)
+        return self._modaliases_stack[-1]
 
     @property
-    def localnames(self) -> Set[str]:
-        ign: Set[str] = set()
-        for ctx in reversed(self.stack):
-            ign.update(ctx.localnames)
-        ign.update(self._localnames)
-        return ign
+    def localnames(self) -> AbstractSet[str]:
+        return self._localnames_stack[-1]
 
     @property
     def inheritance_merge(self) -> Optional[bool]:
@@ -927,7 +1094,10 @@ class CommandContext:
 
     @property
     def canonical(self) -> bool:
-        return any(ctx.op.canonical for ctx in self.stack)
+        for ctx in self.stack:
+            if ctx.op.canonical:
+                return True
+        return False
 
     def in_deletion(self, offset: int = 0) -> bool:
         """Return True if any object is being deleted in this context.
@@ -939,8 +1109,11 @@ class CommandContext:
             True if any object is being deleted in this context starting
             from *offset* in the stack.
         """
-        return any(isinstance(ctx.op, DeleteObject)
-                   for ctx in self.stack[:-offset])
+        stack = self.stack
+        for i in range(len(stack) - offset):
+            if isinstance(stack[i].op, DeleteObject):
+                return True
+        return False
 
     def is_deleting(self, obj: so.Object) -> bool:
         """Return True if *obj* is being deleted in this context.
@@ -955,46 +1128,66 @@ class CommandContext:
                    and ctx.op.scls is obj for ctx in self.stack)
 
     def push(self, token: CommandContextToken[Command]) -> None:
+        pos = len(self.stack)
         self.stack.append(token)
+        by_class = self._by_class
+        for cls in type(token).__mro__:
+            positions = by_class.get(cls)
+            if positions is None:
+                by_class[cls] = [pos]
+            else:
+                positions.append(pos)
+
+        modaliases = self._modaliases_stack[-1]
+        if token.modaliases:
+            modaliases = {**modaliases, **token.modaliases}
+        self._modaliases_stack.append(modaliases)
+
+        localnames = self._localnames_stack[-1]
+        if token.localnames:
+            localnames = localnames | token.localnames
+        self._localnames_stack.append(localnames)
 
     def pop(self) -> CommandContextToken[Command]:
-        return self.stack.pop()
+        self._modaliases_stack.pop()
+        self._localnames_stack.pop()
+        token = self.stack.pop()
+        by_class = self._by_class
+        for cls in type(token).__mro__:
+            by_class[cls].pop()
+        return token
 
     def get(
         self,
         cls: Union[Type[Command], Type[CommandContextToken[Command]]],
     ) -> Optional[CommandContextToken[Command]]:
-        if issubclass(cls, Command):
-            ctxcls = cls.get_context_class()
-            assert ctxcls is not None
+        positions = self._by_class.get(_get_context_class(cls))
+        if positions:
+            return self.stack[positions[-1]]
         else:
-            ctxcls = cls
-
-        for item in reversed(self.stack):
-            if isinstance(item, ctxcls):
-                return item
-
-        return None
+            return None
 
     def get_ancestor(
         self,
         cls: Union[Type[Command], Type[CommandContextToken[Command]]],
         op: Optional[Command] = None,
     ) -> Optional[CommandContextToken[Command]]:
-        if issubclass(cls, Command):
-            ctxcls = cls.get_context_class()
-            assert ctxcls is not None
-        else:
-            ctxcls = cls
+        positions = self._by_class.get(_get_context_class(cls))
+        if not positions:
+            return None
 
+        stack = self.stack
         if op is not None:
-            for item in list(reversed(self.stack)):
-                if isinstance(item, ctxcls) and item.op is not op:
+            for i in reversed(positions):
+                item = stack[i]
+                if item.op is not op:
                     return item
         else:
-            for item in list(reversed(self.stack))[1:]:
-                if isinstance(item, ctxcls):
-                    return item
+            # Skip the current token.
+            if positions[-1] != len(stack) - 1:
+                return stack[positions[-1]]
+            elif len(positions) > 1:
+                return stack[positions[-2]]
 
         return None
 
@@ -1018,12 +1211,26 @@ class CommandContext:
 
     def copy(self) -> CommandContext:
         ctx = CommandContext()
-        ctx.stack = self.stack[:]
+        if self._modaliases or self._localnames:
+            for token in self.stack:
+                ctx.push(token)
+        else:
+            # With no base aliases or local names, the effective ones
+            # at every level are the same as ours, so copy the stacks
+            # instead of pushing every token again.
+            ctx.stack = self.stack[:]
+            ctx._modaliases_stack = self._modaliases_stack[:]
+            ctx._localnames_stack = self._localnames_stack[:]
+            ctx._by_class = {
+                cls: positions[:]
+                for cls, positions in self._by_class.items()
+            }
         return ctx
 
     def at_top(self) -> CommandContext:
         ctx = CommandContext()
-        ctx.stack = ctx.stack[:1]
+        for token in self.stack[:1]:
+            ctx.push(token)
         return ctx
 
     def cache_value(self, key: Hashable, value: Any) -> None:
@@ -1035,20 +1242,46 @@ class CommandContext:
     def drop_cache(self, key: Hashable) -> None:
         self._cache.pop(key, None)
 
+    def get_object_cache(
+        self,
+        schema: s_schema.Schema,
+    ) -> Dict[Tuple[type, str], so.Object]:
+        """Return the cache of objects looked up by name in *schema*.
+
+        Only the most recently used schema is cached.
+        """
+        if self._object_cache_schema is not schema:
+            self._object_cache_schema = schema
+            self._object_cache = {}
+        return self._object_cache
+
+    def get_attribute_cache(self, cmd: Command) -> Dict[str, Any]:
+        """Return the cache of resolved attribute values of *cmd*."""
+        cache = self._attribute_cache.get(cmd)
+        if cache is None:
+            cache = self._attribute_cache[cmd] = {}
+        return cache
+
     def store_value(self, key: Hashable, value: Any) -> None:
         self._values[key] = value
 
     def get_value(self, key: Hashable) -> Any:
         return self._values.get(key)
 
+    def suspend_dep_verification(self) -> ContextManager[CommandContext]:
+        if self.disable_dep_verification:
+            # Already suspended, there is nothing to restore.
+            return contextlib.nullcontext(self)
+        else:
+            return self._suspend_dep_verification()
+
     @contextlib.contextmanager
-    def suspend_dep_verification(self) -> Iterator[CommandContext]:
-        dep_ver = self.disable_dep_verification
+    def _suspend_dep_verification(self) -> Iterator[CommandContext]:
         self.disable_dep_verification = True
         try:
             yield self
         finally:
-            self.disable_dep_verification = dep_ver
+            self.disable_dep_verification = False
 
     def __call__(
         self,
@@ -1058,7 +1291,8 @@ class CommandContext:
 
 
 class DeltaRootContext(CommandContextToken["DeltaRoot"]):
-    pass
+
+    __slots__ = ()
 
 
 class DeltaRoot(CommandGroup, context_class=DeltaRootContext):
@@ -1078,23 +1312,31 @@ class DeltaRoot(CommandGroup, context_class=DeltaRootContext):
         context = context or CommandContext()
 
         with context(DeltaRootContext(schema=schema, op=self)):
-            mods = []
-
-            for cmop in self.get_subcommands(type=modules.CreateModule):
-                schema = cmop.apply(schema, context)
-                mods.append(cmop.scls)
+            # Partition the subcommands in a single pass: modules are
+            # created and altered first, collection types are deleted
+            # last, and everything else is applied in between.
+            module_ops: List[Command] = []
+            alter_module_ops: List[Command] = []
+            delete_collection_ops: List[Command] = []
+            other_ops: List[Command] = []
+            for op in self.get_subcommands():
+                if isinstance(op, modules.CreateModule):
+                    module_ops.append(op)
+                elif isinstance(op, modules.AlterModule):
+                    alter_module_ops.append(op)
+                elif isinstance(op, s_types.DeleteCollectionType):
+                    delete_collection_ops.append(op)
+                else:
+                    other_ops.append(op)
 
-            for amop in self.get_subcommands(type=modules.AlterModule):
-                schema = amop.apply(schema, context)
-                mods.append(amop.scls)
+            module_ops.extend(alter_module_ops)
+            for mop in module_ops:
+                schema = mop.apply(schema, context)
 
-            for objop in self.get_subcommands():
-                if not isinstance(objop, (modules.CreateModule,
-                                          modules.AlterModule,
-                                          s_types.DeleteCollectionType)):
-                    schema = objop.apply(schema, context)
+            for objop in other_ops:
+                schema = objop.apply(schema, context)
 
-            for cop in self.get_subcommands(type=s_types.DeleteCollectionType):
+            for cop in delete_collection_ops:
                 schema = cop.apply(schema, context)
 
         return schema
@@ -1195,6 +1437,11 @@ class ObjectCommand(
     _schema_metaclass: ClassVar[Optional[Type[so.Object_T]]]
     astnode: ClassVar[Union[Type[qlast.DDLOperation],
                             List[Type[qlast.DDLOperation]]]]
+    #: ddl_identity fields of each schema class, filled in lazily
+    #: by get_ddl_identity_fields().
+    _ddl_identity_fields_cache: ClassVar[
+        Dict[type, Tuple[so.Field[Any], ...]]
+    ] = {}
 
     @classmethod
     def _classname_from_ast(
@@ -1240,12 +1487,12 @@ class ObjectCommand(
         finalize_ast: List[qlast.DDLCommand] = []
 
         if expr_refs:
+            from . import functions as s_func
+            from . import indexes as s_indexes
+            from . import pointers as s_pointers
+
             ref_desc = []
             for ref, fn in expr_refs.items():
-                from . import functions as s_func
-                from . import indexes as s_indexes
-                from . import pointers as s_pointers
-
                 cmd_drop: Command
                 cmd_create: Command
 
@@ -1359,8 +1606,8 @@ class ObjectCommand(
                             schema=schema,
                             options=qlcompiler.CompilerOptions(
                                 modaliases=context.modaliases,
-                                anchors={qlast.Source().name: source},
-                                path_prefix_anchor=qlast.Source().name,
+                                anchors={_SOURCE_ANCHOR: source},
+                                path_prefix_anchor=_SOURCE_ANCHOR,
                                 singletons=frozenset([source]),
                             ),
                         )
@@ -1446,7 +1693,7 @@ class ObjectCommand(
 
         if not isinstance(self, DeleteObject):
             fops = self.get_subcommands(type=AlterObjectProperty)
-            for fop in sorted(fops, key=lambda f: f.property):
+            for fop in sorted(fops, key=_get_property):
                 field = mcls.get_field(fop.property)
                 if fop.new_value is not None:
                     new_value = fop.new_value
@@ -1454,7 +1701,7 @@ class ObjectCommand(
                     new_value = field.get_default()
 
                 if (
-                    (fop.source != 'inheritance' or context.descriptive_mode)
+                    (fop.source != _INHERITANCE or context.descriptive_mode)
                     and fop.old_value != new_value
                 ):
                     self._apply_field_ast(schema, context, node, fop)
@@ -1534,7 +1781,12 @@ class ObjectCommand(
         context: CommandContext,
     ) -> Tuple[so.Field[Any], ...]:
         mcls = self.get_schema_metaclass()
-        return tuple(f for f in mcls.get_fields().values() if f.ddl_identity)
+        fields = ObjectCommand._ddl_identity_fields_cache.get(mcls)
+        if fields is None:
+            fields = tuple(
+                f for f in mcls.get_fields().values() if f.ddl_identity)
+            ObjectCommand._ddl_identity_fields_cache[mcls] = fields
+        return fields
 
     @classmethod
     def maybe_get_schema_metaclass(cls) -> Optional[Type[so.Object_T]]:
@@ -1559,24 +1811,32 @@ class ObjectCommand(
         schema: s_schema.Schema,
         context: CommandContext,
     ) -> None:
-        from . import functions as s_func
-        from . import modules as s_mod
-
-        if (not context.stdmode and not context.testmode and
-                not isinstance(self, s_func.ParameterCommand)):
-
-            shortname: str
-            modname: Optional[str]
-            if isinstance(self.classname, sn.Name):
-                shortname = sn.shortname_from_fullname(self.classname)
-                modname = self.classname.module
-            elif issubclass(self.get_schema_metaclass(), s_mod.Module):
+        if context.stdmode or context.testmode:
+            return
+
+        modname: Optional[str]
+        if isinstance(self.classname, sn.Name):
+            modname = self.classname.module
+        else:
+            from . import modules as s_mod
+
+            if issubclass(self.get_schema_metaclass(), s_mod.Module):
                 # modules have classname as simple strings
-                shortname = modname = self.classname
+                modname = self.classname
             else:
                 modname = None
 
-            if modname is not None and modname in s_schema.STD_MODULES:
+        if modname is not None and modname in s_schema.STD_MODULES:
+            # Function parameters are exempt.
+            from . import functions as s_func
+
+            if not isinstance(self, s_func.ParameterCommand):
+                # The short name is only needed for the error message.
+                shortname: str
+                if isinstance(self.classname, sn.Name):
+                    shortname = sn.shortname_from_fullname(self.classname)
+                else:
+                    shortname = self.classname
                 raise errors.SchemaDefinitionError(
                     f'cannot {self._delta_action} `{shortname}`: '
                     f'module {modname} is read-only',
@@ -1660,7 +1920,24 @@ class ObjectCommand(
         if raw_value is None:
             return None
 
-        value = context.get_cached((self, 'attribute', attr_name))
+        return self._resolve_cached_attribute_value(
+            attr_name,
+            raw_value,
+            context.get_attribute_cache(self),
+            schema=schema,
+            context=context,
+        )
+
+    def _resolve_cached_attribute_value(
+        self,
+        attr_name: str,
+        raw_value: Any,
+        cache: Dict[str, Any],
+        *,
+        schema: s_schema.Schema,
+        context: CommandContext,
+    ) -> Any:
+        value = cache.get(attr_name)
         if value is None:
             metaclass = self.get_schema_metaclass()
             field = metaclass.get_field(attr_name)
@@ -1676,7 +1953,7 @@ class ObjectCommand(
                     and not value.is_compiled()):
                 value = self.compile_expr_field(schema, context, field, value)
 
-            context.cache_value((self, 'attribute', attr_name), value)
+            cache[attr_name] = value
 
         return value
 
@@ -1698,10 +1975,14 @@ class ObjectCommand(
         context: CommandContext,
     ) -> Dict[str, Any]:
         result = {}
+        cache = context.get_attribute_cache(self)
 
-        for attr in self.enumerate_attributes():
-            result[attr] = self.get_resolved_attribute_value(
-                attr, schema=schema, context=context)
+        for attr, op in tuple(self._attrs.items()):
+            if op.new_value is None:
+                result[attr] = None
+            else:
+                result[attr] = self._resolve_cached_attribute_value(
+                    attr, op.new_value, cache, schema=schema, context=context)
 
         return result
 
@@ -1766,39 +2047,48 @@ class ObjectCommand(
             return self._get_ast(schema, context, parent_node=parent_node)
 
     def get_ddl_identity(self, aspect: str) -> Any:
-        if self.ddl_identity is None:
+        ddl_identity = self.ddl_identity
+        if ddl_identity is None:
             raise LookupError(f'{self!r} has no DDL identity information')
-        value = self.ddl_identity.get(aspect)
+        value = ddl_identity.get(aspect)
         if value is None:
             raise LookupError(f'{self!r} has no {aspect!r} in DDL identity')
         return value
 
     def has_ddl_identity(self, aspect: str) -> bool:
+        ddl_identity = self.ddl_identity
         return (
-            self.ddl_identity is not None
-            and self.ddl_identity.get(aspect) is not None
+            ddl_identity is not None
+            and ddl_identity.get(aspect) is not None
         )
 
     def set_ddl_identity(self, aspect: str, value: Any) -> None:
-        if self.ddl_identity is None:
-            self.ddl_identity = {}
+        ddl_identity = self.ddl_identity
+        if ddl_identity is None:
+            # A fresh dict always passes the field type check, so
+            # skip the struct __setattr__.
+            ddl_identity = self.__dict__['ddl_identity'] = {}
 
-        self.ddl_identity[aspect] = value
+        ddl_identity[aspect] = value
 
     def get_annotation(self, name: str) -> Any:
-        if self.annotations is None:
+        annotations = self.annotations
+        if annotations is None:
             return None
         else:
-            return self.annotations.get(name)
+            return annotations.get(name)
 
     def set_annotation(self, name: str, value: Any) -> None:
-        if self.annotations is None:
-            self.annotations = {}
-        self.annotations[name] = value
+        annotations = self.annotations
+        if annotations is None:
+            annotations = self.__dict__['annotations'] = {}
+        annotations[name] = value
 
 
 class ObjectCommandContext(CommandContextToken[ObjectCommand[so.Object_T]]):
 
+    __slots__ = ('scls',)
+
     def __init__(
         self,
         schema: s_schema.Schema,
@@ -1871,11 +2161,22 @@ class QualifiedObjectCommand(ObjectCommand[so.QualifiedObject_T]):
             if rename is not None:
                 name = rename
         metaclass = self.get_schema_metaclass()
-        return cast(
-            Optional[so.QualifiedObject_T],
-            schema.get(name, type=metaclass, default=default,
-                       sourcectx=self.source_context),
-        )
+        cache = context.get_object_cache(schema)
+        key = (metaclass, name)
+        obj = cache.get(key)
+        if obj is None:
+            obj = schema.get(name, type=metaclass, default=None)
+            if obj is None:
+                if default is not so.NoDefault:
+                    return default
+                # Let the schema raise the appropriate error.
+                return cast(
+                    Optional[so.QualifiedObject_T],
+                    schema.get(name, type=metaclass, default=default,
+                               sourcectx=self.source_context),
+                )
+            cache[key] = obj
+        return cast(so.QualifiedObject_T, obj)
 
 
 class GlobalObjectCommand(ObjectCommand[so.GlobalObject]):
@@ -1956,13 +2257,14 @@ class CreateObject(ObjectCommand[so.Object_T], Generic[so.Object_T]):
         for op in self.get_prerequisites():
             schema = op.apply(schema, context)
 
+        metaclass = self.get_schema_metaclass()
+
         if context.schema_object_ids is not None:
-            mcls = self.get_schema_metaclass()
             qlclass: Optional[qltypes.SchemaObjectClass]
-            if issubclass(mcls, so.QualifiedObject):
+            if issubclass(metaclass, so.QualifiedObject):
                 qlclass = None
             else:
-                qlclass = mcls.get_ql_class_or_die()
+                qlclass = metaclass.get_ql_class_or_die()
 
             objname = self.classname
             if (
@@ -1986,7 +2288,6 @@ class CreateObject(ObjectCommand[so.Object_T], Generic[so.Object_T]):
             self.validate_create(schema, context)
 
         props = self.get_resolved_attributes(schema, context)
-        metaclass = self.get_schema_metaclass()
         schema, self.scls = metaclass.create_in_schema(schema, **props)
 
         if not props.get('id'):
@@ -2148,7 +2449,7 @@ class RenameObject(AlterObjectFragment[so.Object_T]):
                 orig_value=self.classname,
             )
 
-            if not context.get_value(('renamecanon', self)):
+            if self not in context.canonicalized_renames:
                 commands = self._canonicalize(schema, context, self.scls)
                 self.update(commands)
 
@@ -2165,8 +2466,9 @@ class RenameObject(AlterObjectFragment[so.Object_T]):
         schema: s_schema.Schema,
         context: CommandContext,
     ) -> s_schema.Schema:
+        field_ops = (AlterObjectFragment, AlterObjectProperty)
         for op in self.get_subcommands(include_prerequisites=False):
-            if not isinstance(op, (AlterObjectFragment, AlterObjectProperty)):
+            if not isinstance(op, field_ops):
                 schema = op.apply(schema, context=context)
         return schema
 
@@ -2205,7 +2507,9 @@ class RenameObject(AlterObjectFragment[so.Object_T]):
         commands = []
 
         for refdict in mcls.get_refdicts():
-            all_refs = set(
+            # The refs of an object collection are unique, so there is
+            # no need to collect them into a set.
+            all_refs = (
                 scls.get_field_value(schema, refdict.attr).objects(schema)
             )
 
@@ -2238,7 +2542,7 @@ class RenameObject(AlterObjectFragment[so.Object_T]):
         # Record the fact that RenameObject._canonicalize
         # was called on this object to guard against possible
         # duplicate calls.
-        context.store_value(('renamecanon', self), True)
+        context.canonicalized_renames.add(self)
 
         return commands
 
@@ -2337,13 +2641,15 @@ class AlterObject(ObjectCommand[so.Object_T], Generic[so.Object_T]):
         dropped_bases: List[so.ObjectShell] = []
 
         if getattr(astnode, 'commands', None):
+            mcls = cls.get_schema_metaclass()
+            modaliases = context.modaliases
             for astcmd in astnode.commands:
                 if isinstance(astcmd, qlast.AlterDropInherit):
                     dropped_bases.extend(
                         utils.ast_to_object_shell(
                             b,
-                            metaclass=cls.get_schema_metaclass(),
-                            modaliases=context.modaliases,
+                            metaclass=mcls,
+                            modaliases=modaliases,
                             schema=schema,
                         )
                         for b in astcmd.bases
@@ -2353,8 +2659,8 @@ class AlterObject(ObjectCommand[so.Object_T], Generic[so.Object_T]):
                     bases = [
                         utils.ast_to_object_shell(
                             b,
-                            metaclass=cls.get_schema_metaclass(),
-                            modaliases=context.modaliases,
+                            metaclass=mcls,
+                            modaliases=modaliases,
                             schema=schema,
                         )
                         for b in astcmd.bases
@@ -2369,7 +2675,7 @@ class AlterObject(ObjectCommand[so.Object_T], Generic[so.Object_T]):
                                     f'{pos_node.ref.module}::'
                                     f'{pos_node.ref.name}'
                                 ),
-                                schemaclass=cls.get_schema_metaclass(),
+                                schemaclass=mcls,
                             )
                             pos = (pos_node.position, ref)
                         else:
@@ -2440,8 +2746,9 @@ class AlterObject(ObjectCommand[so.Object_T], Generic[so.Object_T]):
         schema: s_schema.Schema,
         context: CommandContext,
     ) -> s_schema.Schema:
+        field_ops = (AlterObjectFragment, AlterObjectProperty)
         for op in self.get_subcommands(include_prerequisites=False):
-            if not isinstance(op, (AlterObjectFragment, AlterObjectProperty)):
+            if not isinstance(op, field_ops):
                 schema = op.apply(schema, context=context)
 
         return schema
@@ -2505,7 +2812,7 @@ class DeleteObject(ObjectCommand[so.Object_T], Generic[so.Object_T]):
             schema = self.populate_ddl_identity(schema, context)
             schema = self.canonicalize_attributes(schema, context)
 
-            if not context.get_value(('delcanon', self)):
+            if self not in context.canonicalized_deletions:
                 commands = self._canonicalize(schema, context, self.scls)
                 root = DeltaRoot()
                 root.update(commands)
@@ -2524,24 +2831,26 @@ class DeleteObject(ObjectCommand[so.Object_T], Generic[so.Object_T]):
         commands = []
 
         for refdict in mcls.get_refdicts():
-            deleted_refs = set()
-
-            all_refs = set(
+            all_refs = (
                 scls.get_field_value(schema, refdict.attr).objects(schema)
             )
+            if not all_refs:
+                continue
 
             refcmds = cast(
                 Tuple[ObjectCommand[so.Object], ...],
                 self.get_subcommands(metaclass=refdict.ref_cls),
             )
 
-            for op in refcmds:
-                deleted_ref: so.Object = schema.get(op.classname)
-                deleted_refs.add(deleted_ref)
+            # Refs are matched to explicit commands by name, which is
+            # much cheaper to hash than the objects themselves.
+            deleted_names = {op.classname for op in refcmds}
 
             # Add implicit Delete commands for any local refs not
             # deleted explicitly.
-            for ref in all_refs - deleted_refs:
+            for ref in all_refs:
+                if ref.get_name(schema) in deleted_names:
+                    continue
                 op = ref.init_delta_command(schema, DeleteObject)
                 assert isinstance(op, DeleteObject)
                 subcmds = op._canonicalize(schema, context, ref)
@@ -2551,7 +2860,7 @@ class DeleteObject(ObjectCommand[so.Object_T], Generic[so.Object_T]):
         # Record the fact that DeleteObject._canonicalize
         # was called on this object to guard against possible
         # duplicate calls.
-        context.store_value(('delcanon', self), True)
+        context.canonicalized_deletions.add(self)
 
         return commands
 
@@ -2757,12 +3066,8 @@ class AlterObjectProperty(Command):
         *,
         parent_node: Optional[qlast.DDLOperation] = None,
     ) -> Optional[qlast.DDLOperation]:
-        value = self.new_value
-        astcls = qlast.SetField
-
-        new_value_empty = \
-            (value is None or
-                (isinstance(value, collections.abc.Container) and not value))
+        if self.property == 'id':
+            return None
 
         parent_ctx = context.current()
         parent_op = parent_ctx.op
@@ -2770,14 +3075,11 @@ class AlterObjectProperty(Command):
         assert parent_node is not None
         parent_cls = parent_op.get_schema_metaclass()
         field = parent_cls.get_field(self.property)
-        parent_node_attr = parent_op.get_ast_attr_for_field(field.name)
         if field is None:
             raise errors.SchemaDefinitionError(
                 f'{self.property!r} is not a valid field',
                 context=self.source_context)
-
-        if self.property == 'id':
-            return None
+        parent_node_attr = parent_op.get_ast_attr_for_field(field.name)
 
         if (not field.allow_ddl_set
                 and self.property != 'expr'
@@ -2791,7 +3093,7 @@ class AlterObjectProperty(Command):
             #   treated in parser and codegen.
             return None
 
-        if self.source == 'inheritance':
+        if self.source == _INHERITANCE:
             # We don't want to show inherited properties unless
             # we are in "descriptive_mode" and ...
 
@@ -2802,15 +3104,23 @@ class AlterObjectProperty(Command):
                 # skip the AST for it.
                 return None
 
-            parentop_sn = sn.shortname_from_fullname(parent_op.classname).name
-            if self.property == 'default' and parentop_sn == 'id':
+            if (
+                self.property == 'default'
+                and sn.shortname_from_fullname(
+                    parent_op.classname).name == 'id'
+            ):
                 # If it's 'default' for the 'id' property --
                 # skip the AST for it.
                 return None
 
-        if new_value_empty:
+        value = self.new_value
+        if (value is None
+                or (isinstance(value, collections.abc.Container)
+                    and not value)):
             return None
 
+        astcls = qlast.SetField
+
         if issubclass(field.type, s_expr.Expression):
             return self._get_expr_field_ast(
                 schema,
@@ -2849,8 +3159,6 @@ class AlterObjectProperty(Command):
         parent_node: qlast.DDLOperation,
         parent_node_attr: Optional[str],
     ) -> Optional[qlast.DDLOperation]:
-        from edb import edgeql
-
         astcls: Type[qlast.BaseSetField]
 
         assert isinstance(
@@ -2864,7 +3172,8 @@ class AlterObjectProperty(Command):
             astcls = qlast.SetField
 
         parent_cls = parent_op.get_schema_metaclass()
-        has_shadow = parent_cls.has_field(f'orig_{field.name}')
+        orig_fname = f'orig_{field.name}'
+        has_shadow = parent_cls.has_field(orig_fname)
 
         if context.descriptive_mode:
             # When generating AST for DESCRIBE AS TEXT, we want
@@ -2877,12 +3186,11 @@ class AlterObjectProperty(Command):
             # The mangled expression should be the main expression that
             # the object is defined with.
             expr_ql = self.new_value.qlast
-            orig_fname = f'orig_{field.name}'
             assert self.new_value.origtext is not None
             if (
                 has_shadow
-                and not qlast.get_ddl_field_value(parent_node, orig_fname)
                 and self.new_value.text != self.new_value.origtext
+                and not qlast.get_ddl_field_value(parent_node, orig_fname)
             ):
                 parent_node.commands.append(
                     qlast.SetField(
@@ -2892,7 +3200,7 @@ class AlterObjectProperty(Command):
                     )
                 )
 
-        if parent_node is not None and parent_node_attr is not None:
+        if parent_node_attr is not None:
             setattr(parent_node, parent_node_attr, expr_ql)
             return None
         else:
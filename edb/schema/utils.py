@@ -455,8 +455,8 @@ def name_to_ast_ref(name: str) -> qlast.ObjectRef:
 
 def is_nontrivial_container(value: Any) -> Optional[Iterable[Any]]:
     trivial_classes = (str, bytes, bytearray, memoryview)
-    if (isinstance(value, collections.abc.Iterable) and
-            not isinstance(value, trivial_classes)):
+    if (not isinstance(value, trivial_classes) and
+            isinstance(value, collections.abc.Iterable)):
         return value
     else:
         return None
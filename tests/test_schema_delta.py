@@ -0,0 +1,556 @@
+#
+# This source file is part of the EdgeDB open source project.
+#
+# Copyright 2020-present MagicStack Inc. and the EdgeDB authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+import itertools
+import random
+import unittest
+
+from edb.schema import delta as sd
+from edb.schema import objects as so
+
+
+class FakeObject:
+    """A minimal stand-in for a schema object in delta_objects().
+
+    Similarity scores are looked up in a table keyed by
+    (old name, new name), so tests control the comparison matrix
+    directly.
+    """
+
+    def __init__(self, name, scores, *, key=None):
+        self.name = name
+        self.scores = scores
+        self.key = key if key is not None else ('key', id(self))
+
+    def __repr__(self):
+        return f'<FakeObject {self.name!r}>'
+
+    def hash_criteria(self, schema):
+        return self.key
+
+    def get_name(self, schema):
+        return self.name
+
+    def compare(self, other, *, our_schema, their_schema, context):
+        return self.scores.get((self.name, other.name), 0.0)
+
+    def as_create_delta(self, *, schema, context):
+        return sd.CreateObject(classname=self.name)
+
+    def as_delete_delta(self, *, schema, context):
+        return sd.DeleteObject(classname=self.name)
+
+    def as_alter_delta(self, *, other, context, self_schema, other_schema):
+        cmd = sd.AlterObject(classname=self.name)
+        cmd.set_attribute_value('name', other.name)
+        return cmd
+
+
+class FakeCollection(FakeObject):
+    """A fake collection type.
+
+    Like schema collection types, generated ``__id:`` names are
+    disregarded when comparing, so objects with different names
+    may still be a perfect match.
+    """
+
+    def compare(self, other, *, our_schema, their_schema, context):
+        if (
+            self.name.startswith('__id:')
+            and other.name.startswith('__id:')
+        ):
+            return self.scores.get(('__id:', other.name), 1.0)
+        return super().compare(
+            other,
+            our_schema=our_schema,
+            their_schema=their_schema,
+            context=context,
+        )
+
+
+def summarize(delta):
+    result = []
+    for op in delta.get_subcommands():
+        if isinstance(op, sd.CreateObject):
+            result.append(('create', op.classname))
+        elif isinstance(op, sd.DeleteObject):
+            result.append(('delete', op.classname))
+        else:
+            assert isinstance(op, sd.AlterObject)
+            result.append(
+                ('alter', op.classname, op.get_attribute_value('name')))
+    return result
+
+
+def reference_delta_objects(old, new):
+    """The straightforward form of the delta_objects() matching.
+
+    Every pair is compared, the matrix is sorted by similarity and
+    names, and the best remaining pair is picked greedily.  Used as
+    an oracle for the optimized implementation.
+    """
+    oldkeys = {o: o.hash_criteria(None) for o in old}
+    newkeys = {o: o.hash_criteria(None) for o in new}
+    unchanged = set(oldkeys.values()) & set(newkeys.values())
+    old = [o for o in old if oldkeys[o] not in unchanged]
+    new = [o for o in new if newkeys[o] not in unchanged]
+
+    common_names = {o.name for o in old} & {o.name for o in new}
+    pairs = sorted(
+        itertools.product(new, old),
+        key=lambda pair: pair[0].name not in common_names,
+    )
+
+    full_matrix = [
+        (
+            x,
+            y,
+            y.compare(x, our_schema=None, their_schema=None, context=None),
+        )
+        for x, y in pairs
+    ]
+    full_matrix.sort(key=lambda v: (1.0 - v[2], v[0].name, v[1].name))
+
+    seen_x = set()
+    seen_y = set()
+    comparison_map = {}
+    for x, y, similarity in full_matrix:
+        if x not in seen_x and y not in seen_y:
+            comparison_map[x] = (similarity, y)
+            seen_x.add(x)
+            seen_y.add(y)
+
+    matched_x = {x for x, (s, _) in comparison_map.items() if s > 0.6}
+    matched_y = {y for _, (s, y) in comparison_map.items() if s > 0.6}
+
+    result = []
+    result.extend(('create', x.name) for x in new if x not in matched_x)
+    result.extend(
+        ('alter', y.name, x.name)
+        for x, (s, y) in comparison_map.items()
+        if 0.6 < s < 1.0
+    )
+    result.extend(('delete', y.name) for y in old if y not in matched_y)
+    return result
+
+
+def run_delta_objects(old, new):
+    delta = sd.delta_objects(
+        old,
+        new,
+        so.Object,
+        context=so.ComparisonContext(),
+        old_schema=None,
+        new_schema=None,
+    )
+    return summarize(delta)
+
+
+class TestDeltaObjects(unittest.TestCase):
+
+    def test_schema_delta_objects_generated_names(self):
+        # The same-named pair (__id:2, __id:2) is a perfect match, but so
+        # is (__id:2, __id:1), and the latter sorts first by name.  The
+        # greedy selection must pick it, leaving __id:3 to be created and
+        # the old __id:2 to be deleted.
+        scores = {
+            ('__id:', '__id:3'): 0.5,
+        }
+        old = [
+            FakeCollection('__id:1', scores),
+            FakeCollection('__id:2', scores),
+        ]
+        new = [
+            FakeCollection('__id:2', scores),
+            FakeCollection('__id:3', scores),
+        ]
+
+        self.assertEqual(
+            run_delta_objects(old, new),
+            [
+                ('create', '__id:3'),
+                ('delete', '__id:2'),
+            ],
+        )
+
+    def test_schema_delta_objects_mixed(self):
+        # 'a' is altered in place, 'b' is renamed to 'b2', 'c' is
+        # deleted and 'd' is created.  The 0.7 scores tie, and the tie
+        # is broken by the new name, then the old name.
+        scores = {
+            ('a', 'a'): 0.9,
+            ('b', 'b2'): 0.7,
+            ('b', 'd'): 0.7,
+            ('c', 'b2'): 0.7,
+            ('c', 'd'): 0.3,
+        }
+        old = [
+            FakeObject('a', scores),
+            FakeObject('b', scores),
+            FakeObject('c', scores),
+        ]
+        new = [
+            FakeObject('a', scores),
+            FakeObject('b2', scores),
+            FakeObject('d', scores),
+        ]
+
+        expected = [
+            ('create', 'd'),
+            ('alter', 'a', 'a'),
+            ('alter', 'b', 'b2'),
+            ('delete', 'c'),
+        ]
+        self.assertEqual(reference_delta_objects(old, new), expected)
+        self.assertEqual(run_delta_objects(old, new), expected)
+
+    def test_schema_delta_objects_matches_reference(self):
+        # Compare against the reference matching on random inputs.
+        # Scores are drawn from a small set so that ties are common,
+        # and generated names are mixed in so that differently named
+        # objects can be perfect matches.
+        rng = random.Random(20201015)
+        names = ['a', 'b', 'c', 'd', '__id:1', '__id:2', '__id:3']
+        score_choices = (0.0, 0.3, 0.7, 0.7, 0.9, 1.0)
+
+        for _ in range(500):
+            old_names = rng.sample(names, rng.randint(0, len(names)))
+            new_names = rng.sample(names, rng.randint(0, len(names)))
+
+            scores = {}
+            for o, n in itertools.product(old_names + ['__id:'], new_names):
+                scores[o, n] = rng.choice(score_choices)
+
+            # Some objects present on both sides are left unchanged.
+            unchanged = {
+                n for n in set(old_names) & set(new_names)
+                if rng.random() < 0.3
+            }
+
+            def make(name):
+                key = ('key', name) if name in unchanged else None
+                return FakeCollection(name, scores, key=key)
+
+            old = [make(n) for n in old_names]
+            new = [make(n) for n in new_names]
+
+            self.assertEqual(
+                run_delta_objects(old, new),
+                reference_delta_objects(old, new),
+                f'old={old_names!r} new={new_names!r} scores={scores!r}',
+            )
+
+
+class OuterContext(sd.CommandContextToken):
+    pass
+
+
+class InnerContext(OuterContext):
+    pass
+
+
+class TestCommandContext(unittest.TestCase):
+
+    def make_context(self, *, base=True):
+        if base:
+            context = sd.CommandContext(
+                modaliases={None: 'std', 'base': 'basemod'},
+                localnames={'z'},
+            )
+        else:
+            context = sd.CommandContext()
+
+        self.root = sd.DeltaRoot()
+        self.alter_a = sd.AlterObject(classname='a')
+        self.delete_b = sd.DeleteObject(classname='b')
+        self.alter_c = sd.AlterObject(classname='c')
+
+        self.tokens = [
+            sd.DeltaRootContext(None, self.root),
+            OuterContext(
+                None,
+                self.alter_a,
+                modaliases={None: 'default', 'm': 'mod1'},
+                localnames={'x'},
+            ),
+            InnerContext(
+                None,
+                self.delete_b,
+                modaliases={'m': 'mod2'},
+                localnames={'y'},
+            ),
+            OuterContext(None, self.alter_c),
+        ]
+
+        for token in self.tokens:
+            context.push(token)
+
+        return context
+
+    def test_schema_delta_context_get(self):
+        context = self.make_context()
+        t = self.tokens
+
+        self.assertIs(context.get(sd.DeltaRoot), t[0])
+        self.assertIs(context.get(sd.DeltaRootContext), t[0])
+        # Subclass tokens are found by their base context classes.
+        self.assertIs(context.get(OuterContext), t[3])
+        self.assertIs(context.get(InnerContext), t[2])
+
+        context.pop()
+        self.assertIs(context.get(OuterContext), t[2])
+        context.pop()
+        self.assertIs(context.get(OuterContext), t[1])
+        self.assertIsNone(context.get(InnerContext))
+
+        context.pop()
+        context.pop()
+        self.assertIsNone(context.get(sd.DeltaRoot))
+        self.assertIsNone(context.get(OuterContext))
+
+    def test_schema_delta_context_get_ancestor(self):
+        context = self.make_context()
+        t = self.tokens
+
+        # Without an op, the current token is skipped.
+        self.assertIs(context.get_ancestor(OuterContext), t[2])
+        self.assertIs(context.get_ancestor(InnerContext), t[2])
+        self.assertIs(context.get_ancestor(sd.DeltaRoot), t[0])
+
+        # With an op, the tokens of that op are skipped.
+        self.assertIs(
+            context.get_ancestor(OuterContext, op=self.alter_c), t[2])
+        self.assertIs(
+            context.get_ancestor(OuterContext, op=self.delete_b), t[3])
+        self.assertIsNone(
+            context.get_ancestor(InnerContext, op=self.delete_b))
+
+        context.pop()
+        context.pop()
+        self.assertIsNone(context.get_ancestor(OuterContext))
+        self.assertIs(
+            context.get_ancestor(OuterContext, op=self.root), t[1])
+
+    def test_schema_delta_context_modaliases(self):
+        context = self.make_context()
+
+        # Inner tokens take precedence over outer tokens, and those
+        # take precedence over the aliases of the context itself.
+        self.assertEqual(
+            dict(context.modaliases),
+            {None: 'default', 'base': 'basemod', 'm': 'mod2'},
+        )
+
+        context.pop()
+        self.assertEqual(
+            dict(context.modaliases),
+            {None: 'default', 'base': 'basemod', 'm': 'mod2'},
+        )
+
+        context.pop()
+        self.assertEqual(
+            dict(context.modaliases),
+            {None: 'default', 'base': 'basemod', 'm': 'mod1'},
+        )
+
+        context.pop()
+        context.pop()
+        self.assertEqual(
+            dict(context.modaliases),
+            {None: 'std', 'base': 'basemod'},
+        )
+
+    def test_schema_delta_context_localnames(self):
+        context = self.make_context()
+
+        self.assertEqual(set(context.localnames), {'x', 'y', 'z'})
+
+        context.pop()
+        context.pop()
+        self.assertEqual(set(context.localnames), {'x', 'z'})
+
+        context.pop()
+        context.pop()
+        self.assertEqual(set(context.localnames), {'z'})
+
+    def test_schema_delta_context_in_deletion(self):
+        context = self.make_context()
+
+        # The DeleteObject token is third from the bottom.  An offset
+        # of 0 looks at the whole stack.
+        self.assertTrue(context.in_deletion())
+        self.assertTrue(context.in_deletion(offset=0))
+        self.assertTrue(context.in_deletion(offset=1))
+        self.assertFalse(context.in_deletion(offset=2))
+
+        context.pop()
+        self.assertTrue(context.in_deletion())
+        self.assertFalse(context.in_deletion(offset=1))
+
+        context.pop()
+        self.assertFalse(context.in_deletion())
+
+    def test_schema_delta_context_copy(self):
+        for base in (True, False):
+            context = self.make_context(base=base)
+            t = self.tokens
+
+            copy = context.copy()
+            self.assertIs(copy.get(InnerContext), t[2])
+            self.assertIs(copy.get_ancestor(OuterContext), t[2])
+            self.assertTrue(copy.in_deletion(offset=1))
+            # The aliases and local names of the context itself are
+            # not carried over, only those of the tokens.
+            self.assertEqual(
+                dict(copy.modaliases),
+                {None: 'default', 'm': 'mod2'},
+            )
+            self.assertEqual(set(copy.localnames), {'x', 'y'})
+
+            # The copy has its own stack.
+            copy.pop()
+            self.assertIs(context.get(OuterContext), t[3])
+            self.assertIs(copy.get(OuterContext), t[2])
+
+
+class TestCommandSubcommands(unittest.TestCase):
+
+    # (type, include_prerequisites) combinations used to prime and to
+    # check the get_subcommands() memo.
+    queries = list(itertools.product(
+        (None, sd.AlterObjectProperty, sd.ObjectCommand, sd.CreateObject),
+        (True, False),
+    ))
+
+    def make_command(self):
+        cmd = sd.AlterObject(classname='t')
+        cmd.add(sd.AlterObjectProperty(property='a', new_value=1))
+        cmd.add(sd.CreateObject(classname='x'))
+        cmd.add_prerequisite(sd.AlterObject(classname='p'))
+        return cmd
+
+    def make_group(self):
+        group = sd.CommandGroup()
+        group.add(sd.AlterObjectProperty(property='b', new_value=2))
+        group.add(sd.CreateObject(classname='y'))
+        group.add_prerequisite(sd.DeleteObject(classname='q'))
+        return group
+
+    def expected_subcommands(self, cmd, type, include_prerequisites):
+        # Computed from scratch, bypassing the memo.
+        if include_prerequisites:
+            ops = itertools.chain(cmd.before_ops, cmd.ops)
+        else:
+            ops = cmd.ops
+        return tuple(i for i in ops if type is None or isinstance(i, type))
+
+    def prime(self, cmd):
+        for type, include_prerequisites in self.queries:
+            cmd.get_subcommands(
+                type=type, include_prerequisites=include_prerequisites)
+
+    def assert_subcommands(self, cmd):
+        for type, include_prerequisites in self.queries:
+            self.assertEqual(
+                cmd.get_subcommands(
+                    type=type, include_prerequisites=include_prerequisites),
+                self.expected_subcommands(
+                    cmd, type, include_prerequisites),
+                f'type={type!r} '
+                f'include_prerequisites={include_prerequisites!r}',
+            )
+
+    def test_schema_delta_subcommands_invalidation(self):
+        def replace(cmd):
+            existing = cmd.get_subcommands(type=sd.CreateObject)[0]
+            cmd.replace(existing, sd.DeleteObject(classname='z'))
+
+        def discard(cmd):
+            cmd.discard(cmd.get_subcommands(type=sd.CreateObject)[0])
+
+        def discard_prerequisite(cmd):
+            cmd.discard(cmd.get_prerequisites()[0])
+
+        def discard_attr(cmd):
+            cmd.discard(cmd.get_subcommands(type=sd.AlterObjectProperty)[0])
+
+        mutations = {
+            'add': lambda cmd: cmd.add(
+                sd.CreateObject(classname='n')),
+            'add group': lambda cmd: cmd.add(self.make_group()),
+            'prepend': lambda cmd: cmd.prepend(
+                sd.AlterObjectProperty(property='c', new_value=3)),
+            'prepend group': lambda cmd: cmd.prepend(self.make_group()),
+            'add_prerequisite': lambda cmd: cmd.add_prerequisite(
+                sd.CreateObject(classname='n')),
+            'add_prerequisite group': lambda cmd: cmd.add_prerequisite(
+                self.make_group()),
+            'prepend_prerequisite': lambda cmd: cmd.prepend_prerequisite(
+                sd.CreateObject(classname='n')),
+            'prepend_prerequisite group':
+                lambda cmd: cmd.prepend_prerequisite(self.make_group()),
+            'replace': replace,
+            'replace_all': lambda cmd: cmd.replace_all(
+                self.make_group().get_subcommands()),
+            'replace_all empty': lambda cmd: cmd.replace_all(()),
+            'discard': discard,
+            'discard prerequisite': discard_prerequisite,
+            'discard attribute': discard_attr,
+        }
+
+        for name, mutate in mutations.items():
+            with self.subTest(mutation=name):
+                cmd = self.make_command()
+                self.prime(cmd)
+                mutate(cmd)
+                self.assert_subcommands(cmd)
+
+    def test_schema_delta_subcommands_prepend_order(self):
+        cmd = self.make_command()
+        existing = cmd.get_subcommands(type=sd.CreateObject)[0]
+        group = self.make_group()
+        group.add(existing)
+        cmd.prepend(group)
+
+        # Subcommands of the group come first, in their original order,
+        # prerequisites of the group included.  Commands that were
+        # already present move to the front.
+        self.assertEqual(
+            cmd.get_subcommands(include_prerequisites=False),
+            group.get_subcommands() + (
+                cmd.get_subcommands(type=sd.AlterObjectProperty)[-1],
+            ),
+        )
+        self.assertEqual(cmd.get_attribute_value('b'), 2)
+        self.assertEqual(cmd.get_attribute_value('a'), 1)
+
+    def test_schema_delta_subcommands_reverse(self):
+        cmd = self.make_command()
+        cmd.add(self.make_group())
+        cmd.prepend_prerequisite(self.make_group())
+
+        for c in (cmd, sd.AlterObject(classname='empty'), self.make_group()):
+            self.assertEqual(
+                tuple(c._iter_subcommands(reverse=True)),
+                tuple(reversed(c.get_subcommands())),
+            )
+            self.assertEqual(
+                tuple(c._iter_subcommands()),
+                c.get_subcommands(),
+            )